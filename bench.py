@@ -0,0 +1,166 @@
+import asyncio
+import time
+import tracemalloc
+import zlib
+
+import quassel
+from qtdatastream import Qint16, Qint32, Quint32, QUserType, QVariant, QVariantList
+from quassel.protocol import BufferInfo
+
+
+class NullTransport:
+    def write(self, data):
+        pass
+
+    def get_write_buffer_size(self):
+        return 0
+
+    def pause_reading(self):
+        pass
+
+    def resume_reading(self):
+        pass
+
+
+def frame(message):
+    data = QVariantList([QVariant(x) for x in message]).encode()
+    return bytes(Quint32(len(data)).encode() + data)
+
+
+def session_protocol(metrics=True, compression=False):
+    protocol = quassel.QuasselClientProtocol(None, 'user', 'password')
+    protocol.transport = NullTransport()
+    protocol._probing = False
+    protocol._handshake = True
+    if not metrics:
+        protocol.metrics = None
+    if compression:
+        protocol.connection_features = quassel.FEATURE_COMPRESSION
+        protocol._deflater = zlib.compressobj(level=9)
+    return protocol
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    function(*args)
+    return time.perf_counter() - start
+
+
+def best_of(repeat, *candidates):
+    """Runs the (function, args) candidates alternately and returns the best time of each"""
+    best = [None] * len(candidates)
+    for i in range(repeat):
+        for index, (function, args) in enumerate(candidates):
+            elapsed = timed(function, *args)
+            if best[index] is None or elapsed < best[index]:
+                best[index] = elapsed
+    return best
+
+
+def feed(protocol, chunks):
+    for chunk in chunks:
+        protocol.data_received(chunk)
+
+
+def bench_metrics_overhead(count=2000, repeat=60):
+    """Compares handling SYNC frames with and without instrumentation
+
+    Many short alternating runs are timed and the fastest run of each side is compared,
+    which keeps scheduler noise out of the overhead figure.
+    """
+    data = b''.join(frame([Qint16(quassel.SYNC), b'IrcUser', b'1/nick', b'setAway', i % 2 == 0]) for i in range(100))
+    chunks = [data] * (count // 100)
+
+    plain, instrumented = best_of(repeat,
+                                  (feed, (session_protocol(metrics=False), chunks)),
+                                  (feed, (session_protocol(metrics=True), chunks)))
+
+    print('frames per run:          {0} x {1} runs'.format(count, repeat))
+    print('without metrics:         {0:.0f} frames/s ({1:.2f} us/frame)'.format(count / plain, plain / count * 1000000))
+    print('with metrics:            {0:.0f} frames/s ({1:.2f} us/frame)'.format(count / instrumented, instrumented / count * 1000000))
+    print('metrics overhead:        {0:.1f}% ({1:.2f} us/frame)'.format(
+        (instrumented / plain - 1) * 100, (instrumented - plain) / count * 1000000))
+
+
+BUFFER_INFO = {'bufferId': 1, 'networkId': 1, 'type': 2, 'groupId': 0, 'name': '#quassel'}
+
+
+def send_messages(protocol, count):
+    for i in range(count):
+        protocol.send_message([Qint16(quassel.SYNC), b'BufferSyncer', b'', b'requestSetLastSeenMsg',
+                               QUserType('BufferId', Qint32(1)), QUserType('MsgId', Qint32(i))])
+        protocol.send_message([Qint16(quassel.RPC), b'2sendInput(BufferInfo,QString)',
+                               QUserType('BufferInfo', BufferInfo(BUFFER_INFO)), 'hello'])
+
+
+def send_calls(protocol, count):
+    for i in range(count):
+        protocol.sync('BufferSyncer', '', 'requestSetLastSeenMsg', Qint32(1), Qint32(i), arg_types=('BufferId', 'MsgId'))
+        protocol.rpc('2sendInput(BufferInfo,QString)', BufferInfo(BUFFER_INFO), 'hello', arg_types=('BufferInfo', None))
+
+
+def bench_call_templates(count=20000, repeat=5):
+    """Compares send_message with pre-encoded call templates
+
+    Each iteration sends a requestSetLastSeenMsg(BufferId, MsgId) SYNC call and a
+    sendInput(BufferInfo, QString) RPC call.
+    """
+    for compression in (False, True):
+        plain, templated = best_of(repeat,
+                                   (send_messages, (session_protocol(compression=compression), count)),
+                                   (send_calls, (session_protocol(compression=compression), count)))
+
+        print('calls ({0}):'.format('compressed' if compression else 'uncompressed'))
+        print('  send_message:          {0:.0f} calls/s'.format(2 * count / plain))
+        print('  call template:         {0:.0f} calls/s'.format(2 * count / templated))
+        print('  speedup:               {0:.2f}x'.format(plain / templated))
+
+
+def bench_manager_accounts(counts=(1, 50), repeat=1000):
+    """Measures what each connected account of a ConnectionManager costs
+
+    Memory is the traced allocation per account once all accounts are connected to
+    a local server, it includes the server side streams of each connection. stats is
+    the time of one ConnectionManager.stats() call divided by the number of accounts.
+    """
+    for count in counts:
+        loop = asyncio.new_event_loop()
+        writers = []
+
+        async def handle(reader, writer):
+            writers.append(writer)
+
+        server = loop.run_until_complete(asyncio.start_server(handle, '127.0.0.1', 0))
+        port = server.sockets[0].getsockname()[1]
+        manager = quassel.ConnectionManager(loop)
+
+        async def connected():
+            while manager.stats()['connected'] < count or len(writers) < count:
+                await asyncio.sleep(0.01)
+
+        tracemalloc.start()
+        start = tracemalloc.take_snapshot()
+        for i in range(count):
+            manager.add_account('account{0}'.format(i), '127.0.0.1', port, 'user', 'password')
+        manager.start()
+        loop.run_until_complete(connected())
+        memory = sum(stat.size_diff for stat in tracemalloc.take_snapshot().compare_to(start, 'filename'))
+        tracemalloc.stop()
+        stats = timed(lambda: [manager.stats() for i in range(repeat)])
+
+        print('{0} accounts:'.format(count))
+        print('  memory per account:    {0:.1f} KiB'.format(memory / count / 1024))
+        print('  stats per account:     {0:.2f} us'.format(stats / repeat / count * 1000000))
+
+        manager.stop()
+        for writer in writers:
+            writer.close()
+        server.close()
+        loop.run_until_complete(server.wait_closed())
+        loop.close()
+
+
+if __name__ == '__main__':
+    bench_metrics_overhead()
+    bench_call_templates()
+    bench_manager_accounts()
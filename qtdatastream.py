@@ -2,16 +2,27 @@
 module to work with binary data according to DataStream version 8 (Qt_4_2)
 
 All helper classes implement a static decode function that decodes a
-python type out of a bytes object.
+python type out of a bytes object, and a static skip function that moves a
+stream past a value without building any python objects for it.
 
 In order to facilitate custom user types in QVariant all custom types must
-be registered via the register_user_type decorator
+be registered via the register_user_type decorator, values are encoded as user
+type by wrapping them in QUserType
+
+QDate, QTime and QDateTime values can be decoded to plain integers instead of
+datetime objects by decoding from a DataStream with date_mode DATE_MODE_EPOCH
 """
 
 import datetime
+import functools
 import io
 import struct
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 QBOOL = 1
 QINT = 2
 QUINT = 3
@@ -31,8 +42,19 @@ QINT8 = 131
 QUINT16 = 133
 QUINT8 = 134
 
+DATE_MODE_OBJECTS = 'objects'
+DATE_MODE_EPOCH = 'epoch'
+
+DATE_CACHE_SIZE = 1024          # number of distinct days kept by the date caches
+JULIAN_DAY_UNIX_EPOCH = 2440588  # 1970-01-01
+JULIAN_DAY_MIN = 1721426        # 0001-01-01, smallest date python can represent
+JULIAN_DAY_MAX = 5373484        # 9999-12-31, largest date python can represent
+MSECS_PER_DAY = 86400000
+
 _qt_types = {}
-_user_types = {}
+_user_type_decoders = {}
+_qt_skippers = {}
+_user_type_skippers = {}
 _python_types = {}
 
 
@@ -47,21 +69,51 @@ def register_mapping(qt_type, python_type=None):
         if python_type is not None:
             _python_types[python_type] = cls
         _qt_types[qt_type] = cls.decode
+        if hasattr(cls, 'skip'):
+            _qt_skippers[qt_type] = cls.skip
         setattr(cls, 'QT_TYPE', qt_type)
         return cls
     return decorator
 
 
 def register_user_type(name):
-    """Registers a class as Qt user type for QVariant decoding"""
+    """Registers a class as Qt user type for QVariant decoding
+
+    Instead of a class a registered qt_type can be given, the user type is
+    then decoded as an alias of that type.
+    Classes should provide a static skip method that moves a stream past a value
+    without decoding it, if missing values are decoded and discarded when skipped.
+    """
     def decorator(cls):
         if cls not in _qt_types and not hasattr(cls, 'decode'):
             raise TypeError('class does not provide decode method')
-        _user_types[name] = cls
+        _user_type_decoders[_user_type_key(name)] = _user_type_decoder(cls)
+        _user_type_skippers[_user_type_key(name)] = _user_type_skipper(cls)
         return cls
     return decorator
 
 
+def _user_type_key(name):
+    """Returns the name of a user type as it appears on the wire after its length"""
+    return name.encode('utf-8') + b'\0'
+
+
+def _user_type_decoder(cls):
+    """Resolves a registered user type (class or qt_type alias) to its decode function"""
+    if cls in _qt_types:
+        return _qt_types[cls]
+    return cls.decode
+
+
+def _user_type_skipper(cls):
+    """Resolves a registered user type (class or qt_type alias) to its skip function"""
+    if cls in _qt_types:
+        return _qt_skippers[cls]
+    if hasattr(cls, 'skip'):
+        return cls.skip
+    return cls.decode
+
+
 class DataStreamException(Exception):
     pass
 
@@ -86,19 +138,66 @@ class QtType:
     pass
 
 
+class DataStream(io.BytesIO):
+    """BytesIO that carries decode settings, like the version of a QDataStream
+
+    date_mode selects how QDate, QTime and QDateTime values are decoded from this stream.
+    DATE_MODE_OBJECTS decodes to datetime.date, datetime.time and datetime.datetime.
+    DATE_MODE_EPOCH decodes to plain integers without building any datetime objects:
+    days since the unix epoch for QDate, milliseconds since midnight for QTime and
+    milliseconds since the unix epoch for QDateTime.
+    Plain bytes and BytesIO objects are decoded with DATE_MODE_OBJECTS.
+    """
+    def __init__(self, initial_bytes=b'', date_mode=DATE_MODE_OBJECTS):
+        if date_mode not in (DATE_MODE_OBJECTS, DATE_MODE_EPOCH):
+            raise ValueError('invalid date mode {0}'.format(date_mode))
+        super().__init__(initial_bytes)
+        self.date_mode = date_mode
+
+
 @register_mapping(QUSERTYPE)
 class UserType(QtType):
     @staticmethod
     def decode(data):
         name_length = Quint32.decode(data)
-        name = data.read(name_length)[:-1].decode('utf-8')
-        if name in _user_types:
-            if _user_types[name] in _qt_types:
-                return _qt_types[_user_types[name]](data)
-            else:
-                return _user_types[name].decode(data)
+        name = data.read(name_length)
+        decoder = _user_type_decoders.get(name)
+        if decoder is not None:
+            return decoder(data)
+
+        raise DecodeException('unknown user type {0}'.format(name[:-1].decode('utf-8', 'replace')))
+
+    @staticmethod
+    def skip(data):
+        name_length = Quint32.decode(data)
+        name = data.read(name_length)
+        skipper = _user_type_skippers.get(name)
+        if skipper is not None:
+            return skipper(data)
+
+        raise DecodeException('unknown user type {0}'.format(name[:-1].decode('utf-8', 'replace')))
+
 
-        raise DecodeException('unknown user type {0}'.format(name))
+class QUserType(QtType):
+    """Encodes a value as Qt user type name, e.g. QUserType('BufferId', Qint32(1))
+
+    data is encoded with its own encode method after the user type name.
+    """
+    QT_TYPE = QUSERTYPE
+
+    def __init__(self, name, data):
+        self.name = name
+        self.data = data
+
+    def encode(self):
+        return self.prefix(self.name) + self.data.encode()
+
+    @staticmethod
+    @functools.lru_cache(maxsize=None)
+    def prefix(name):
+        """Returns the encoded name of a user type that precedes its value"""
+        key = _user_type_key(name)
+        return Quint32(len(key)).encode() + key
 
 
 @register_mapping(QBOOL, bool)
@@ -114,6 +213,10 @@ class QBool(QtType):
         data = Quint8.decode(data)
         return data == 1
 
+    @staticmethod
+    def skip(data):
+        data.seek(1, io.SEEK_CUR)
+
 
 @register_mapping(QINT8)
 class Qint8(QtType):
@@ -129,6 +232,10 @@ class Qint8(QtType):
             data = data.read(1)
         return struct.unpack('b', data)[0]
 
+    @staticmethod
+    def skip(data):
+        data.seek(1, io.SEEK_CUR)
+
 
 @register_mapping(QUINT8)
 class Quint8(QtType):
@@ -144,6 +251,10 @@ class Quint8(QtType):
             data = data.read(1)
         return struct.unpack('B', data)[0]
 
+    @staticmethod
+    def skip(data):
+        data.seek(1, io.SEEK_CUR)
+
 
 @register_mapping(QINT16)
 class Qint16(QtType):
@@ -159,6 +270,10 @@ class Qint16(QtType):
             data = data.read(2)
         return struct.unpack('!h', data)[0]
 
+    @staticmethod
+    def skip(data):
+        data.seek(2, io.SEEK_CUR)
+
 
 @register_mapping(QUINT16)
 class Quint16(QtType):
@@ -174,6 +289,10 @@ class Quint16(QtType):
             data = data.read(2)
         return struct.unpack('!H', data)[0]
 
+    @staticmethod
+    def skip(data):
+        data.seek(2, io.SEEK_CUR)
+
 
 @register_mapping(QINT)
 class Qint32(QtType):
@@ -189,6 +308,10 @@ class Qint32(QtType):
             data = data.read(4)
         return struct.unpack('!i', data)[0]
 
+    @staticmethod
+    def skip(data):
+        data.seek(4, io.SEEK_CUR)
+
 
 @register_mapping(QUINT)
 class Quint32(QtType):
@@ -204,6 +327,10 @@ class Quint32(QtType):
             data = data.read(4)
         return struct.unpack('!I', data)[0]
 
+    @staticmethod
+    def skip(data):
+        data.seek(4, io.SEEK_CUR)
+
 
 @register_mapping(QBYTEARRAY, bytes)
 class QByteArray(QtType):
@@ -227,6 +354,12 @@ class QByteArray(QtType):
 
         return data.read(length)
 
+    @staticmethod
+    def skip(data):
+        length = Quint32.decode(data)
+        if length != 0xFFFFFFFF:
+            data.seek(length, io.SEEK_CUR)
+
 
 @register_mapping(QSTRING, str)
 class QString(QtType):
@@ -252,6 +385,12 @@ class QString(QtType):
         string = data.read(length).decode('utf-16-be')
         return string
 
+    @staticmethod
+    def skip(data):
+        length = Quint32.decode(data)
+        if length != 0xFFFFFFFF:
+            data.seek(length, io.SEEK_CUR)
+
 
 @register_mapping(QSTRINGLIST)
 class QStringList(QtType):
@@ -267,6 +406,12 @@ class QStringList(QtType):
 
         return list
 
+    @staticmethod
+    def skip(data):
+        count = Quint32.decode(data)
+        for i in range(count):
+            QString.skip(data)
+
 
 @register_mapping(QDATE, datetime.date)
 class QDate(QtType):
@@ -289,10 +434,31 @@ class QDate(QtType):
 
     @staticmethod
     def decode(data):
+        if getattr(data, 'date_mode', DATE_MODE_OBJECTS) == DATE_MODE_EPOCH:
+            return QDate.decode_epoch(data)
         julian_day = Quint32.decode(data)
 
         if julian_day == 0:     # QDate::nullJd
             return None
+        return QDate.from_julian_day(julian_day)
+
+    @staticmethod
+    def decode_epoch(data):
+        """Decodes a QDate as days since the unix epoch"""
+        julian_day = Quint32.decode(data)
+
+        if julian_day == 0:     # QDate::nullJd
+            return None
+        return julian_day - JULIAN_DAY_UNIX_EPOCH
+
+    @staticmethod
+    def skip(data):
+        data.seek(4, io.SEEK_CUR)
+
+    @staticmethod
+    @functools.lru_cache(maxsize=DATE_CACHE_SIZE)
+    def from_julian_day(julian_day):
+        """Converts a julian day to datetime.date, recently used days are cached"""
         a = julian_day + 32044
         b = (4 * a + 3) // 146097
         c = a - (146097 * b) // 4
@@ -327,10 +493,29 @@ class QTime(QtType):
 
     @staticmethod
     def decode(data):
+        if getattr(data, 'date_mode', DATE_MODE_OBJECTS) == DATE_MODE_EPOCH:
+            return QTime.decode_epoch(data)
         milliseconds = Quint32.decode(data)
         if milliseconds == 0xFFFFFFFF:
             return None
 
+        return QTime.from_milliseconds(milliseconds)
+
+    @staticmethod
+    def decode_epoch(data):
+        """Decodes a QTime as milliseconds since midnight"""
+        milliseconds = Quint32.decode(data)
+        if milliseconds == 0xFFFFFFFF:
+            return None
+
+        return milliseconds
+
+    @staticmethod
+    def skip(data):
+        data.seek(4, io.SEEK_CUR)
+
+    @staticmethod
+    def from_milliseconds(milliseconds):
         seconds, milliseconds = divmod(milliseconds, 1000)
         minutes, seconds = divmod(seconds, 60)
         hours, minutes = divmod(minutes, 60)
@@ -352,13 +537,146 @@ class QDateTime(QtType):
 
     @staticmethod
     def decode(data):
-        date = QDate.decode(data)
-        time = QTime.decode(data)
-        is_utc = Quint8.decode(data.read(1))    # TODO handle?
+        if getattr(data, 'date_mode', DATE_MODE_OBJECTS) == DATE_MODE_EPOCH:
+            return QDateTime.decode_epoch(data)
+        julian_day, milliseconds, is_utc = _datetime_struct.unpack(data.read(9))    # TODO handle is_utc?
 
-        if date is None or time is None:
+        if julian_day == 0 or milliseconds == 0xFFFFFFFF:
             return None
-        return datetime.datetime.combine(date, time)
+        return QDateTime.midnight(julian_day) + datetime.timedelta(milliseconds=milliseconds)
+
+    @staticmethod
+    def decode_epoch(data):
+        """Decodes a QDateTime as milliseconds since the unix epoch"""
+        julian_day, milliseconds, is_utc = _datetime_struct.unpack(data.read(9))
+
+        if julian_day == 0 or milliseconds == 0xFFFFFFFF:
+            return None
+        return (julian_day - JULIAN_DAY_UNIX_EPOCH) * MSECS_PER_DAY + milliseconds
+
+    @staticmethod
+    def skip(data):
+        data.seek(9, io.SEEK_CUR)
+
+    @staticmethod
+    def from_epoch(milliseconds):
+        """Converts milliseconds since the unix epoch, as decoded with DATE_MODE_EPOCH, to datetime.datetime"""
+        julian_day, milliseconds = divmod(milliseconds, MSECS_PER_DAY)
+        return QDateTime.midnight(julian_day + JULIAN_DAY_UNIX_EPOCH) + datetime.timedelta(milliseconds=milliseconds)
+
+    @staticmethod
+    def to_epoch(value):
+        """Converts a naive UTC datetime.datetime to milliseconds since the unix epoch"""
+        return (value - _unix_epoch) // datetime.timedelta(milliseconds=1)
+
+    @staticmethod
+    @functools.lru_cache(maxsize=DATE_CACHE_SIZE)
+    def midnight(julian_day):
+        """Returns the datetime.datetime at the start of a julian day, recently used days are cached"""
+        return datetime.datetime.combine(QDate.from_julian_day(julian_day), datetime.time())
+
+
+_datetime_struct = struct.Struct('!IIB')
+_unix_epoch = datetime.datetime(1970, 1, 1)
+
+
+def dates_from_julian_days(julian_days):
+    """Converts a sequence of julian days to a list of datetime.date
+
+    Null days (0) are returned as None, days before 0001-01-01 as 0001-01-01 like
+    QDate.decode does. Days after 9999-12-31 raise ValueError.
+    """
+    if numpy is not None:
+        julian_days = numpy.asarray(julian_days, dtype=numpy.int64)
+        nulls = julian_days == 0
+        _check_julian_days(julian_days[~nulls])
+        days = numpy.maximum(julian_days, JULIAN_DAY_MIN) - JULIAN_DAY_UNIX_EPOCH
+        dates = days.astype('datetime64[D]').astype(object)
+        dates[nulls] = None
+        return dates.tolist()
+
+    from_julian_day = QDate.from_julian_day
+    return [from_julian_day(julian_day) if julian_day != 0 else None for julian_day in julian_days]
+
+
+def datetimes_from_julian_days(julian_days, milliseconds):
+    """Converts sequences of julian days and milliseconds since midnight to a list of datetime.datetime
+
+    Null values are returned as None, out of range values are handled like in dates_from_julian_days.
+    """
+    if numpy is not None:
+        julian_days = numpy.asarray(julian_days, dtype=numpy.int64)
+        milliseconds = numpy.asarray(milliseconds, dtype=numpy.int64)
+        nulls = (julian_days == 0) | (milliseconds == 0xFFFFFFFF)
+        days = numpy.maximum(julian_days, JULIAN_DAY_MIN) - JULIAN_DAY_UNIX_EPOCH
+        return _datetimes_from_epoch(days * MSECS_PER_DAY + milliseconds, nulls)
+
+    midnight = QDateTime.midnight
+    timedelta = datetime.timedelta
+    try:
+        return [midnight(julian_day) + timedelta(milliseconds=msecs)
+                if julian_day != 0 and msecs != 0xFFFFFFFF else None
+                for julian_day, msecs in zip(julian_days, milliseconds)]
+    except OverflowError as e:
+        raise ValueError(str(e))
+
+
+def datetimes_from_epoch(milliseconds):
+    """Converts a sequence of milliseconds since the unix epoch, as decoded with DATE_MODE_EPOCH,
+    to a list of datetime.datetime
+
+    None values are returned as None, out of range values are handled like in dates_from_julian_days.
+    """
+    if numpy is not None:
+        milliseconds = numpy.asarray(milliseconds, dtype=object)
+        nulls = numpy.equal(milliseconds, None)
+        milliseconds[nulls] = 0
+        return _datetimes_from_epoch(milliseconds.astype(numpy.int64), nulls)
+
+    from_epoch = QDateTime.from_epoch
+    return [from_epoch(msecs) if msecs is not None else None for msecs in milliseconds]
+
+
+def epoch_from_julian_days(julian_days, milliseconds=None):
+    """Converts julian days (and optionally milliseconds since midnight) to milliseconds since the unix epoch
+
+    Returns a list of ints like the other batch conversions. No datetime objects are
+    built, null values are returned as None like with DATE_MODE_EPOCH.
+    """
+    if numpy is not None:
+        julian_days = numpy.asarray(julian_days, dtype=numpy.int64)
+        epoch = (julian_days - JULIAN_DAY_UNIX_EPOCH) * MSECS_PER_DAY
+        nulls = julian_days == 0
+        if milliseconds is not None:
+            milliseconds = numpy.asarray(milliseconds, dtype=numpy.int64)
+            epoch += milliseconds
+            nulls |= milliseconds == 0xFFFFFFFF
+        epoch = epoch.astype(object)
+        epoch[nulls] = None
+        return epoch.tolist()
+
+    if milliseconds is None:
+        return [(julian_day - JULIAN_DAY_UNIX_EPOCH) * MSECS_PER_DAY if julian_day != 0 else None
+                for julian_day in julian_days]
+    return [(julian_day - JULIAN_DAY_UNIX_EPOCH) * MSECS_PER_DAY + msecs
+            if julian_day != 0 and msecs != 0xFFFFFFFF else None
+            for julian_day, msecs in zip(julian_days, milliseconds)]
+
+
+def _check_julian_days(julian_days):
+    if julian_days.size and julian_days.max() > JULIAN_DAY_MAX:
+        raise ValueError('julian day {0} is out of range'.format(julian_days.max()))
+
+
+def _datetimes_from_epoch(epoch, nulls):
+    """numpy version of QDateTime.from_epoch for an int64 array, nulls are returned as None"""
+    days, milliseconds = numpy.divmod(epoch, MSECS_PER_DAY)
+    _check_julian_days(days[~nulls] + JULIAN_DAY_UNIX_EPOCH)
+    # like QDate.from_julian_day days before 0001-01-01 count as 0001-01-01
+    days = numpy.maximum(days, JULIAN_DAY_MIN - JULIAN_DAY_UNIX_EPOCH)
+    datetimes = (days * MSECS_PER_DAY + milliseconds).astype('datetime64[ms]').astype(object)
+    datetimes[nulls] = None
+    return datetimes.tolist()
 
 
 class QVariant(QtType):
@@ -390,6 +708,15 @@ class QVariant(QtType):
         else:
             raise DecodeException('invalid data type {0} at position {1}'.format(type, data.tell() - 5))
 
+    @staticmethod
+    def skip(data):
+        type = Quint32.decode(data)
+        data.seek(1, io.SEEK_CUR)    # ignore null flag
+        if type in _qt_skippers:
+            _qt_skippers[type](data)
+        else:
+            raise DecodeException('invalid data type {0} at position {1}'.format(type, data.tell() - 5))
+
 
 @register_mapping(QVARIANTMAP)
 class QVariantMap(QtType):
@@ -406,6 +733,13 @@ class QVariantMap(QtType):
 
         return dict
 
+    @staticmethod
+    def skip(data):
+        entries = Quint32.decode(data)
+        for i in range(entries):
+            QString.skip(data)
+            QVariant.skip(data)
+
 
 @register_mapping(QVARIANTLIST)
 class QVariantList(QtType):
@@ -438,3 +772,9 @@ class QVariantList(QtType):
             list_data.append(QVariant.decode(buffer))
 
         return list_data
+
+    @staticmethod
+    def skip(data):
+        length = Quint32.decode(data)
+        for x in range(length):
+            QVariant.skip(data)
@@ -1,4 +1,6 @@
 from .protocol import QuasselClientProtocol
+from .manager import ConnectionManager
+from .calls import CallTemplate
 
 PROTOCOL_VERSION = 10
 MAGIC = 0x42b33f00
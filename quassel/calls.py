@@ -0,0 +1,65 @@
+import functools
+import struct
+
+import quassel
+from qtdatastream import QUSERTYPE, Qint8, Qint16, Quint32, QByteArray, QUserType, QVariant
+
+CALL_TEMPLATE_CACHE_SIZE = 1024
+
+_frame_header = struct.Struct('!II')    # frame length, QVariantList length
+
+
+class CallTemplate:
+    """Outbound message with a fixed, pre-encoded head
+
+    The message type and the class, object and slot names are encoded once when the
+    template is created, encode only has to encode the variable arguments.
+
+    arg_types optionally names the user type of each argument, e.g. ('BufferId', 'MsgId'),
+    the QVariant header of those arguments is encoded once as well and the argument
+    itself only has to provide encode, e.g. Qint32(1). None leaves an argument as is.
+    """
+    __slots__ = ('head', 'head_length', 'arg_headers')
+
+    def __init__(self, message_type, *names, arg_types=None):
+        head = bytearray(QVariant(Qint16(message_type)).encode())
+        for name in names:
+            head.extend(QVariant(QByteArray(name.encode('utf-8') if name is not None else None)).encode())
+        self.head = bytes(head)
+        self.head_length = 1 + len(names)
+        self.arg_headers = tuple(
+            Quint32(QUSERTYPE).encode() + Qint8(0).encode() + QUserType.prefix(arg_type) if arg_type is not None else None
+            for arg_type in arg_types or ())
+
+    def encode(self, args):
+        """Returns the complete frame, length prefixes included, for a call with args"""
+        data = [b'', self.head]
+        arg_headers = self.arg_headers
+        for index, arg in enumerate(args):
+            header = arg_headers[index] if index < len(arg_headers) else None
+            if header is not None:
+                data.append(header)
+                data.append(arg.encode())
+            else:
+                data.append(QVariant(arg).encode())
+        data[0] = _frame_header.pack(4 + sum(map(len, data)), self.head_length + len(args))
+        return b''.join(data)
+
+
+@functools.lru_cache(maxsize=CALL_TEMPLATE_CACHE_SIZE)
+def sync_call(class_name, object_name, slot_name, arg_types=None):
+    """Returns the cached template for a SYNC call of slot_name on an object
+
+    e.g. sync_call('BufferSyncer', '', 'requestSetLastSeenMsg', ('BufferId', 'MsgId'))
+    """
+    return CallTemplate(quassel.SYNC, class_name, object_name, slot_name, arg_types=arg_types)
+
+
+@functools.lru_cache(maxsize=CALL_TEMPLATE_CACHE_SIZE)
+def rpc_call(slot_name, arg_types=None):
+    """Returns the cached template for an RPC call, slot_name is the full signature
+
+    e.g. rpc_call('2sendInput(BufferInfo,QString)', ('BufferInfo', None)) called with a
+    BufferInfo and a str
+    """
+    return CallTemplate(quassel.RPC, slot_name, arg_types=arg_types)
@@ -0,0 +1,185 @@
+import functools
+import logging
+import random
+
+from .protocol import QuasselClientProtocol
+
+log = logging.getLogger(__name__)
+
+
+class Account:
+    """Connection settings and reconnect state of one core account"""
+    __slots__ = ('name', 'host', 'port', 'user', 'password', 'protocol_factory', 'protocol',
+                 'attempts', 'reconnect_handle', 'bytes_received', 'bytes_sent')
+
+    def __init__(self, name, host, port, user, password, protocol_factory):
+        self.name = name
+        self.host = host
+        self.port = port
+        self.user = user
+        self.password = password
+        self.protocol_factory = protocol_factory
+        self.protocol = None
+        self.attempts = 0
+        self.reconnect_handle = None
+        self.bytes_received = 0     # totals of previous connections
+        self.bytes_sent = 0
+
+
+class ConnectionManager:
+    """Runs the connections of many core accounts on one event loop
+
+    All protocols share the module level codec registry and decode caches, the
+    manager only keeps a small Account record per account. Lost connections are
+    reconnected with exponential backoff and random jitter.
+
+    While running, receive and send rates are sampled every rate_interval seconds.
+    """
+    def __init__(self, loop, reconnect_delay=1.0, max_reconnect_delay=300.0, rate_interval=10.0):
+        self.loop = loop
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+        self.rate_interval = rate_interval
+        self.accounts = {}
+        self.receive_rate = 0.0
+        self.send_rate = 0.0
+        self._running = False
+        self._last_sample = None
+        self._rate_handle = None
+
+    def add_account(self, name, host, port, user, password, protocol_factory=QuasselClientProtocol):
+        if name in self.accounts:
+            raise ValueError('account {0} already exists'.format(name))
+
+        account = Account(name, host, port, user, password, protocol_factory)
+        self.accounts[name] = account
+        if self._running:
+            self._connect(account)
+        return account
+
+    def remove_account(self, name):
+        account = self.accounts.pop(name)
+        self._disconnect(account)
+
+    def start(self):
+        self._running = True
+        for account in self.accounts.values():
+            if account.protocol is None and account.reconnect_handle is None:
+                self._connect(account)
+        if self._rate_handle is None:
+            self._sample_rates()
+
+    def stop(self):
+        self._running = False
+        if self._rate_handle is not None:
+            self._rate_handle.cancel()
+            self._rate_handle = None
+        self._last_sample = None
+        self.receive_rate = 0.0
+        self.send_rate = 0.0
+        for account in self.accounts.values():
+            self._disconnect(account)
+
+    def stats(self):
+        """Returns aggregate counters over all accounts
+
+        receive_rate and send_rate are bytes per second over the last rate_interval, 0 while stopped.
+        """
+        connected = 0
+        queue_depth = 0
+        for account in self.accounts.values():
+            protocol = account.protocol
+            if protocol is not None and protocol.transport is not None and not protocol.transport.is_closing():
+                connected += 1
+                queue_depth += protocol.queue_depth
+        bytes_received, bytes_sent = self._byte_totals()
+
+        return {
+            'accounts': len(self.accounts),
+            'connected': connected,
+            'bytes_received': bytes_received,
+            'bytes_sent': bytes_sent,
+            'receive_rate': self.receive_rate,
+            'send_rate': self.send_rate,
+            'queue_depth': queue_depth
+        }
+
+    def _byte_totals(self):
+        bytes_received = 0
+        bytes_sent = 0
+        for account in self.accounts.values():
+            bytes_received += account.bytes_received
+            bytes_sent += account.bytes_sent
+            if account.protocol is not None:
+                bytes_received += account.protocol.bytes_received
+                bytes_sent += account.protocol.bytes_sent
+        return bytes_received, bytes_sent
+
+    def _sample_rates(self):
+        now = self.loop.time()
+        bytes_received, bytes_sent = self._byte_totals()
+        if self._last_sample is not None:
+            last_time, last_received, last_sent = self._last_sample
+            if now > last_time:
+                self.receive_rate = (bytes_received - last_received) / (now - last_time)
+                self.send_rate = (bytes_sent - last_sent) / (now - last_time)
+        self._last_sample = (now, bytes_received, bytes_sent)
+        self._rate_handle = self.loop.call_later(self.rate_interval, self._sample_rates)
+
+    def _connect(self, account):
+        log.info('Connecting account {0} to {1}:{2}'.format(account.name, account.host, account.port))
+        account.reconnect_handle = None
+
+        on_connection_lost = functools.partial(self._connection_lost, account)
+
+        def protocol_factory():
+            # tracked from creation on, the connection may be lost before _connect_done runs
+            protocol = account.protocol_factory(self.loop, account.user, account.password, on_connection_lost=on_connection_lost)
+            account.protocol = protocol
+            return protocol
+
+        connect = self.loop.create_connection(protocol_factory, account.host, account.port)
+        task = self.loop.create_task(connect)
+        task.add_done_callback(functools.partial(self._connect_done, account))
+
+    def _connect_done(self, account, task):
+        if task.cancelled():
+            return
+
+        exc = task.exception()
+        if exc is not None:
+            log.warning('Connecting account {0} failed: {1}'.format(account.name, exc))
+            account.protocol = None
+            self._schedule_reconnect(account)
+            return
+
+        transport, protocol = task.result()
+        if transport.is_closing():      # already lost, _connection_lost took care of it
+            return
+        if not self._running or self.accounts.get(account.name) is not account:
+            transport.close()
+
+    def _connection_lost(self, account, protocol, exc):
+        account.bytes_received += protocol.bytes_received
+        account.bytes_sent += protocol.bytes_sent
+        if account.protocol is protocol:
+            account.protocol = None
+        if protocol._handshake:     # the session was up, start backing off from scratch
+            account.attempts = 0
+
+        if self._running and self.accounts.get(account.name) is account:
+            self._schedule_reconnect(account)
+
+    def _schedule_reconnect(self, account):
+        delay = min(self.max_reconnect_delay, self.reconnect_delay * 2 ** min(account.attempts, 16))
+        delay = random.uniform(delay / 2, delay)
+        account.attempts += 1
+        log.info('Reconnecting account {0} in {1:.1f}s'.format(account.name, delay))
+        account.reconnect_handle = self.loop.call_later(delay, self._connect, account)
+
+    def _disconnect(self, account):
+        if account.reconnect_handle is not None:
+            account.reconnect_handle.cancel()
+            account.reconnect_handle = None
+        if account.protocol is not None and account.protocol.transport is not None:
+            account.protocol.transport.close()
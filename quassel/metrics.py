@@ -0,0 +1,153 @@
+import collections
+import logging
+
+log = logging.getLogger(__name__)
+
+HISTOGRAM_BUCKETS = 32
+ROLLING_WINDOW = 1024
+
+
+class Histogram:
+    """Histogram with power of two buckets
+
+    Bucket i counts values v with 2 ** (i - 1) <= v < 2 ** i, bucket 0 counts values below 1,
+    the last bucket also counts everything above its range.
+    """
+    __slots__ = ('buckets',)
+
+    def __init__(self, bucket_count=HISTOGRAM_BUCKETS):
+        self.buckets = [0] * bucket_count
+
+    @property
+    def count(self):
+        return sum(self.buckets)
+
+    def add(self, value):
+        bucket = int(value).bit_length()
+        if bucket >= len(self.buckets):
+            bucket = len(self.buckets) - 1
+        self.buckets[bucket] += 1
+
+    def percentile(self, fraction):
+        """Returns the upper bound of the bucket containing the given fraction of all values"""
+        count = self.count
+        if count == 0:
+            return 0
+        rank = fraction * count
+        seen = 0
+        for bucket, bucket_count in enumerate(self.buckets):
+            seen += bucket_count
+            if seen >= rank:
+                return 2 ** bucket
+        return 2 ** (len(self.buckets) - 1)
+
+    def snapshot(self):
+        return {
+            'count': self.count,
+            'p50': self.percentile(0.5),
+            'p99': self.percentile(0.99),
+            'buckets': list(self.buckets)
+        }
+
+
+class RollingHistogram:
+    """Keeps the most recent samples for exact percentiles over a rolling window"""
+    __slots__ = ('samples',)
+
+    def __init__(self, size=ROLLING_WINDOW):
+        self.samples = collections.deque(maxlen=size)
+
+    def add(self, value):
+        self.samples.append(value)
+
+    def percentile(self, fraction):
+        if not self.samples:
+            return 0
+        samples = sorted(self.samples)
+        return samples[min(len(samples) - 1, int(fraction * len(samples)))]
+
+    def snapshot(self):
+        samples = sorted(self.samples)
+        if not samples:
+            return {'count': 0, 'p50': 0, 'p99': 0, 'max': 0}
+        return {
+            'count': len(samples),
+            'p50': samples[int(0.5 * len(samples))],
+            'p99': samples[min(len(samples) - 1, int(0.99 * len(samples)))],
+            'max': samples[-1]
+        }
+
+
+class Metrics:
+    """Counters of one connection, cheap enough to be always on
+
+    payload_bytes_in and payload_bytes_out count the datastream bytes before compression,
+    the bytes on the wire are counted by the protocol itself (bytes_received, bytes_sent).
+    Frames are counted per message type and SYNC frames also per class name. Decode
+    times are collected per message type in microseconds for every
+    decode_sample_interval-th frame, timing every frame would cost more than counting.
+
+    Link health is tracked in milliseconds over rolling windows: rtt is the heartbeat
+    round trip time, loop_lag how late the heartbeat timer fired and dispatch_lag the
+    time between a frame arriving and its event reaching the events() consumer.
+
+    Hooks are called as hook(message_type, class_name, size, decode_time) for every
+    decoded frame, class_name is the raw class name for SYNC frames and None otherwise,
+    decode_time is None for frames that were not timed. Exceptions raised by hooks
+    are logged and do not interrupt message handling.
+    """
+    def __init__(self, decode_sample_interval=16):
+        self.payload_bytes_in = 0
+        self.payload_bytes_out = 0
+        self.frame_counts = {}
+        self.frames_skipped = 0
+        self.decode_sample_interval = decode_sample_interval
+        self.decode_sample_countdown = 1
+        self.sync_classes = {}
+        self.decode_times = {}
+        self.buffer_high_water = 0
+        self.rtt = RollingHistogram()
+        self.loop_lag = RollingHistogram()
+        self.dispatch_lag = RollingHistogram()
+        self.hooks = []
+
+    def add_hook(self, hook):
+        self.hooks.append(hook)
+
+    def remove_hook(self, hook):
+        self.hooks.remove(hook)
+
+    def frame(self, message_type, class_name, size, decode_time=None):
+        frame_counts = self.frame_counts
+        frame_counts[message_type] = frame_counts.get(message_type, 0) + 1
+
+        if decode_time is not None:
+            histogram = self.decode_times.get(message_type)
+            if histogram is None:
+                histogram = self.decode_times[message_type] = Histogram()
+            histogram.add(decode_time * 1000000)
+
+        if class_name is not None:
+            sync_classes = self.sync_classes
+            sync_classes[class_name] = sync_classes.get(class_name, 0) + 1
+
+        if self.hooks:
+            for hook in self.hooks:
+                try:
+                    hook(message_type, class_name, size, decode_time)
+                except Exception:
+                    log.exception('metrics hook {0!r} failed'.format(hook))
+
+    def snapshot(self):
+        return {
+            'payload_bytes_in': self.payload_bytes_in,
+            'payload_bytes_out': self.payload_bytes_out,
+            'frames': dict(self.frame_counts),
+            'frames_skipped': self.frames_skipped,
+            'sync_classes': {name.decode('utf-8', 'replace'): count for name, count in self.sync_classes.items()},
+            'decode_times': {message_type: histogram.snapshot() for message_type, histogram in self.decode_times.items()},
+            'buffer_high_water': self.buffer_high_water,
+            'rtt': self.rtt.snapshot(),
+            'loop_lag': self.loop_lag.snapshot(),
+            'dispatch_lag': self.dispatch_lag.snapshot()
+        }
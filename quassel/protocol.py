@@ -1,14 +1,21 @@
 import asyncio
 import asyncio.sslproto
+import collections
 import io
 import ipaddress
 import logging
 import ssl
+import time
 import zlib
 
 import quassel
 import qtdatastream
-from qtdatastream import register_user_type, Quint8, Qint16, Qint32, Quint32, QByteArray, QVariant, QVariantMap, QVariantList
+from qtdatastream import register_user_type, DataStream, Quint8, Qint16, Qint32, Quint32, QByteArray, QDateTime, QVariant, QVariantMap, QVariantList
+
+from .calls import rpc_call, sync_call
+from .metrics import Metrics
+
+log = logging.getLogger(__name__)
 
 if not hasattr(zlib, 'Z_PARTIAL_FLUSH'):
     zlib.Z_PARTIAL_FLUSH = 0x1
@@ -19,6 +26,15 @@ class BufferInfo(qtdatastream.QtType):
     def __init__(self, data):
         self.data = data
 
+    def encode(self):
+        data = bytearray()
+        data.extend(Qint32(self.data['bufferId']).encode())
+        data.extend(Qint32(self.data['networkId']).encode())
+        data.extend(Qint16(self.data['type']).encode())
+        data.extend(Quint32(self.data['groupId']).encode())
+        data.extend(QByteArray(self.data['name'].encode('utf-8')).encode())
+        return data
+
     @staticmethod
     def decode(data):
         return {
@@ -29,6 +45,11 @@ class BufferInfo(qtdatastream.QtType):
             'name': QByteArray.decode(data).decode('utf-8')
         }
 
+    @staticmethod
+    def skip(data):
+        data.seek(14, io.SEEK_CUR)  # bufferId, networkId, type, groupId
+        QByteArray.skip(data)
+
 
 @register_user_type('Message')
 class Message(qtdatastream.QtType):
@@ -47,30 +68,188 @@ class Message(qtdatastream.QtType):
             'contents': QByteArray.decode(data).decode('utf-8')
         }
 
+    @staticmethod
+    def skip(data):
+        data.seek(13, io.SEEK_CUR)  # msgId, timeStamp, type, flags
+        BufferInfo.skip(data)
+        QByteArray.skip(data)
+        QByteArray.skip(data)
+
+
+register_user_type('NetworkInfo')(qtdatastream.QVARIANTMAP)
+register_user_type('Network::Server')(qtdatastream.QVARIANTMAP)
+register_user_type('Identity')(qtdatastream.QVARIANTMAP)
+register_user_type('IdentityId')(qtdatastream.QINT)
+register_user_type('BufferId')(qtdatastream.QINT)
+register_user_type('NetworkId')(qtdatastream.QINT)
+register_user_type('UserId')(qtdatastream.QINT)
+register_user_type('AccountId')(qtdatastream.QINT)
+register_user_type('MsgId')(qtdatastream.QINT)
+# QVariant?
+
+
+Event = collections.namedtuple('Event', ['type', 'class_name', 'object_name', 'slot_name', 'params'])
+
+
+class EventStream:
+    """Async iterator returned by QuasselClientProtocol.events"""
+    def __init__(self, protocol):
+        self.protocol = protocol
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        return await self.protocol.next_event()
+
 
 class QuasselClientProtocol(asyncio.Protocol):
-    def __init__(self, loop, user, password):
+    """Client side of a single quassel core connection
+
+    If on_connection_lost is given it is called with the protocol and the exception
+    when the connection is lost, otherwise the event loop is stopped.
+
+    If message_filter is given only SYNC, RPC and INIT_DATA messages it accepts are
+    decoded, see accept_message.
+
+    Counters and hooks are kept in metrics, a new Metrics instance unless one is
+    given. Setting the metrics attribute to None turns instrumentation off.
+
+    Once the session is up a timestamped heartbeat is sent every heartbeat_interval
+    seconds (None disables it) to measure the round trip time. If nothing was
+    received or a heartbeat is unanswered for stall_timeout seconds (default three
+    intervals) the link is considered stalled and the connection is aborted. Time
+    during which reading is paused for a slow events() consumer does not count.
+
+    date_mode is the qtdatastream date mode used to decode messages of this connection.
+    """
+    def __init__(self, loop, user, password, on_connection_lost=None, message_filter=None, metrics=None,
+                 heartbeat_interval=30.0, stall_timeout=None, date_mode=qtdatastream.DATE_MODE_OBJECTS):
         self.connection_features = 0x0
         self.loop = loop
         self.user = user
         self.password = password
+        self.on_connection_lost = on_connection_lost
+        self.message_filter = message_filter
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.heartbeat_interval = heartbeat_interval
+        if stall_timeout is None and heartbeat_interval is not None:
+            stall_timeout = 3 * heartbeat_interval
+        self.stall_timeout = stall_timeout
+        self.latency = None
+        self.bytes_received = 0     # wire bytes, counted even without metrics
+        self.bytes_sent = 0
+        self.date_mode = date_mode
+        self.transport = None
+        self._last_received = time.monotonic()
+        self._reading_resumed = self._last_received
+        self._heartbeats = collections.OrderedDict()
+        self._heartbeat_handle = None
+        self._heartbeat_due = None
         self._probing = True
         self._handshake = False
-        self._buffer = io.BytesIO()
-
-        register_user_type('NetworkInfo')(qtdatastream.QVARIANTMAP)
-        register_user_type('Network::Server')(qtdatastream.QVARIANTMAP)
-        register_user_type('Identity')(qtdatastream.QVARIANTMAP)
-        register_user_type('IdentityId')(qtdatastream.QINT)
-        register_user_type('BufferId')(qtdatastream.QINT)
-        register_user_type('NetworkId')(qtdatastream.QINT)
-        register_user_type('UserId')(qtdatastream.QINT)
-        register_user_type('AccountId')(qtdatastream.QINT)
-        register_user_type('MsgId')(qtdatastream.QINT)
-        # QVariant?
+        self._buffer = DataStream(date_mode=date_mode)
+        self._events = None
+        self._events_maxsize = 0
+        self._events_types = None
+        self._events_classes = None
+        self._events_filtered = False
+        self._events_paused = False
+        self._reading_paused = False
+        self._events_closed = False
+        self._events_waiter = None
+
+    @property
+    def queue_depth(self):
+        """Number of bytes received but not handled yet plus bytes waiting to be sent"""
+        depth = 0 if self._probing else self._buffer.tell()
+        if self.transport is not None:
+            depth += self.transport.get_write_buffer_size()
+        return depth
+
+    def events(self, message_types=None, class_names=None, maxsize=1024):
+        """Returns an async iterator over the SYNC, RPC and INIT_DATA messages of the session
+
+        Only messages whose type is in message_types (default all three) and, for SYNC and INIT_DATA, whose
+        class name is in class_names (if given) are turned into Event tuples and queued. The filter
+        is checked on the message header by accept_message, other messages of these types are
+        skipped without being decoded and do not reach handle_regular_message either.
+        Once maxsize events are queued no further frames are handled and reading from
+        the transport is paused until the consumer has drained half of the queue.
+        The iterator ends when the connection is lost.
+        """
+        if self._events is not None:
+            raise RuntimeError('events() can only be called once per connection')
+
+        self._events = collections.deque()
+        self._events_maxsize = maxsize
+        all_types = frozenset((quassel.SYNC, quassel.RPC, quassel.INIT_DATA))
+        self._events_types = frozenset(message_types) if message_types is not None else all_types
+        if class_names is not None:
+            self._events_classes = frozenset(name.encode('utf-8') for name in class_names)
+        self._events_filtered = self._events_types != all_types or self._events_classes is not None
+        return EventStream(self)
+
+    def events_accept(self, message_type, class_name):
+        """Checks a message header against the events() filter"""
+        if message_type not in self._events_types:
+            return False
+        return self._events_classes is None or class_name is None or class_name in self._events_classes
+
+    def queue_event(self, message_type, class_name, object_name, slot_name, params):
+        if self._events is None:
+            return
+
+        if class_name is not None:
+            class_name = class_name.decode('utf-8')
+        if slot_name is not None:
+            slot_name = slot_name.decode('utf-8')
+        self._events.append((self._last_received, Event(message_type, class_name, object_name, slot_name, params)))
+        self._wake_events()
+
+        if len(self._events) >= self._events_maxsize:
+            self._events_paused = True
+            if not self._reading_paused:
+                self._reading_paused = True
+                self.transport.pause_reading()
+
+    async def next_event(self):
+        while not self._events:
+            if self._events_closed:
+                raise StopAsyncIteration
+            self._events_waiter = self.loop.create_future()
+            try:
+                await self._events_waiter
+            finally:
+                self._events_waiter = None
+
+        if self._events_paused and len(self._events) - 1 <= self._events_maxsize // 2:
+            self._resume_events()   # before popping, if a handler raises the event stays queued
+        arrival, event = self._events.popleft()
+        if self.metrics is not None:
+            self.metrics.dispatch_lag.add((time.monotonic() - arrival) * 1000)
+        return event
+
+    def _wake_events(self):
+        if self._events_waiter is not None and not self._events_waiter.done():
+            self._events_waiter.set_result(None)
+
+    def _resume_events(self):
+        self._events_paused = False
+        try:
+            self.handle_data()      # frames buffered while paused, may fill the queue again
+        finally:
+            # even if a handler raised into the consumer, reading must not stay paused
+            if not self._events_paused and self._reading_paused and not self._events_closed:
+                self._reading_paused = False
+                self._reading_resumed = time.monotonic()
+                self.transport.resume_reading()
+
+    def write(self, data):
+        self.bytes_sent += len(data)
+        self.transport.write(data)
 
     def connection_made(self, transport):
-        log = logging.getLogger(__name__)
         log.info('Connection made')
         self.transport = transport
 
@@ -82,77 +261,81 @@ class QuasselClientProtocol(asyncio.Protocol):
         probe_data = bytearray()
         probe_data.extend(Quint32(request_features).encode())
         probe_data.extend(Quint32(quassel.DATASTREAMPROTOCOL | quassel.DATASTREAMFEATURES | quassel.LIST_END).encode())
-        transport.write(probe_data)
+        self.write(probe_data)
 
     def data_received(self, data):
-        log = logging.getLogger(__name__)
+        self._last_received = time.monotonic()
+        self.bytes_received += len(data)
         if self.connection_features & quassel.FEATURE_ENCRYPTION:
             ssl_data, data = self._sslPipe.feed_ssldata(data)
             data = b''.join(data)
-            self.transport.write(b''.join(ssl_data))
+            if ssl_data:
+                self.write(b''.join(ssl_data))
 
         if not data:  # in ssl handshake no application data is transmitted
             return
 
         if self.connection_features & quassel.FEATURE_COMPRESSION:
             data = self._inflater.decompress(data)
-        log.debug('data received: {0}'.format(repr(data)))
+        log.debug('data received: %r', data)
+        metrics = self.metrics
+        if metrics is not None:
+            metrics.payload_bytes_in += len(data)
         if self._probing:
             self.handle_probe_response(data)
         else:
             self._buffer.write(data)
+            if metrics is not None and self._buffer.tell() > metrics.buffer_high_water:
+                metrics.buffer_high_water = self._buffer.tell()
             self.handle_data()
 
     def handle_data(self):
-        log = logging.getLogger(__name__)
-        buffer_end = self._buffer.tell()
-
-        if buffer_end < 4:         # can we read message size?
+        if self._events_paused:     # frames stay buffered while the event consumer is behind
             return
-        self._buffer.seek(0)
-        message_length = Quint32.decode(self._buffer)
 
-        if message_length > buffer_end + 4:
-            self._buffer.seek(buffer_end)
-            return
+        buffer = self._buffer
+        buffer_end = buffer.tell()
+        buffer_position = 0
+        buffer.seek(0)
 
         try:
-            self.handle_message(self._buffer)
-        except qtdatastream.DecodeException as e:
-            self._buffer.seek(4 + message_length)
-            log.error(e)
-
-        buffer_position = self._buffer.tell()
-        while buffer_end - buffer_position >= 4:    # any trailing messages in the data?
-            message_length = Quint32.decode(self._buffer)
-
-            if message_length <= buffer_end - (buffer_position + 4):
+            while not self._events_paused and buffer_end - buffer_position >= 4:   # can we read message size?
+                buffer.seek(buffer_position)
+                message_length = Quint32.decode(buffer)
+                message_end = buffer_position + 4 + message_length
+                if message_end > buffer_end:
+                    break
+
+                # the frame counts as consumed even if a handler raises
+                buffer_position = message_end
                 try:
-                    self.handle_message(self._buffer)
+                    self.handle_message(buffer)
                 except qtdatastream.DecodeException as e:
-                    self._buffer.seek(buffer_position + message_length)
                     log.error(e)
-
+        finally:
+            # keep the unhandled bytes with the write position at their end
+            if buffer_position == 0:    # e.g. a large frame still arriving, don't copy it again
+                buffer.seek(buffer_end)
+            elif buffer_position == buffer_end:
+                buffer.seek(0)
             else:
-                break
-
-            buffer_position = self._buffer.tell()
-
-        available_bytes = buffer_end - buffer_position
-
-        if available_bytes > 0:
-            self._buffer.seek(buffer_position)
-            self._buffer = io.BytesIO(self._buffer.read())
-        elif available_bytes == 0:
-            self._buffer.seek(0)
+                buffer.seek(buffer_position)
+                self._buffer = DataStream(date_mode=self.date_mode)
+                self._buffer.write(buffer.read(buffer_end - buffer_position))
 
     def connection_lost(self, exc):
-        log = logging.getLogger(__name__)
         log.warning('Connection lost')
-        self.loop.stop()
+        self._events_closed = True
+        self._wake_events()
+        if self._heartbeat_handle is not None:
+            self._heartbeat_handle.cancel()
+            self._heartbeat_handle = None
+        if self.on_connection_lost is not None:
+            self.on_connection_lost(self, exc)
+        else:
+            self.loop.stop()
 
     def handle_probe_response(self, data):
-        log = logging.getLogger(__name__)
         probe_response = Quint32.decode(data)
         self.proto_type = probe_response & 0xFF
         log.info('protocol type: {0}'.format(quassel.PROTOCOLS[self.proto_type]))
@@ -178,7 +361,7 @@ class QuasselClientProtocol(asyncio.Protocol):
                 else:
                     print('handshake failed')
 
-            self.transport.write(b''.join(self._sslPipe.do_handshake(callback)))
+            self.write(b''.join(self._sslPipe.do_handshake(callback)))
         else:
             self.register_client()
 
@@ -202,29 +385,41 @@ class QuasselClientProtocol(asyncio.Protocol):
         return data
 
     def send_data(self, data, flush=False):
+        if self.metrics is not None:
+            self.metrics.payload_bytes_out += len(data)
         if self.connection_features & quassel.FEATURE_ENCRYPTION:
             if self.connection_features & quassel.FEATURE_COMPRESSION:
                 compressed_data = self._deflater.compress(data)
                 compressed_data += self._deflater.flush(zlib.Z_PARTIAL_FLUSH)
 
                 ssl_data, offset = self._sslPipe.feed_appdata(compressed_data)
-                self.transport.write(b''.join(ssl_data))
+                self.write(b''.join(ssl_data))
             else:
-                ssl_data, offset = self._sslPipe.feed_appdata(compressed_data)
-                self.transport.write(b''.join(ssl_data))
+                ssl_data, offset = self._sslPipe.feed_appdata(data)
+                self.write(b''.join(ssl_data))
         else:
             if self.connection_features & quassel.FEATURE_COMPRESSION:
-                self.transport.write(self._deflater.compress(data))
+                self.write(self._deflater.compress(data))
                 if flush:
-                    self.transport.write(self._deflater.flush(zlib.Z_PARTIAL_FLUSH))
+                    self.write(self._deflater.flush(zlib.Z_PARTIAL_FLUSH))
             else:
-                self.transport.write(data)
+                self.write(data)
 
     def send_message(self, message):
         data = QVariantList([QVariant(x) for x in message]).encode()
         self.send_data(Quint32(len(data)).encode())     # Message length
         self.send_data(data, True)                      # Message data
 
+    def send_call(self, template, *args):
+        """Sends a call from a CallTemplate, only args are encoded per call"""
+        self.send_data(template.encode(args), True)
+
+    def sync(self, class_name, object_name, slot_name, *args, arg_types=None):
+        self.send_call(sync_call(class_name, object_name, slot_name, arg_types), *args)
+
+    def rpc(self, slot_name, *args, arg_types=None):
+        self.send_call(rpc_call(slot_name, arg_types), *args)
+
     def send_legacy_message(self, message):
         data = self.data_streamify(message)
         self.send_data(Quint32(len(data)).encode())     # Message length
@@ -235,12 +430,25 @@ class QuasselClientProtocol(asyncio.Protocol):
         self.send_legacy_message(message)
 
     def handle_message(self, raw_message_stream):
-        log = logging.getLogger(__name__)
+        metrics = self.metrics
+        filtered = self.message_filter is not None or self._events_filtered
+        if self._handshake and filtered and not self.accept_message(raw_message_stream):
+            if metrics is not None:
+                metrics.frames_skipped += 1
+            return
+
+        if metrics is not None:
+            start_position = raw_message_stream.tell()
+            metrics.decode_sample_countdown -= 1
+            timed = metrics.decode_sample_countdown == 0
+            if timed:
+                metrics.decode_sample_countdown = metrics.decode_sample_interval
+                start_time = time.perf_counter()
         list_data = QVariantList.decode(raw_message_stream)
 
         if not self._handshake:
             message_data = self.data_destreamify(list_data)
-            log.debug(repr(message_data))
+            log.debug('%r', message_data)
 
             msg_type = message_data['MsgType']
             if msg_type == 'ClientInitAck':
@@ -255,10 +463,51 @@ class QuasselClientProtocol(asyncio.Protocol):
             else:
                 log.warning('Unknown message type {0}'.format(msg_type))
         else:
+            if metrics is not None and list_data:
+                decode_time = time.perf_counter() - start_time if timed else None
+                message_type = list_data[0]
+                class_name = list_data[1] if message_type == quassel.SYNC and len(list_data) > 1 else None
+                metrics.frame(message_type, class_name, raw_message_stream.tell() - start_position, decode_time)
             self.handle_regular_message(list_data)
 
+    def accept_message(self, stream):
+        """Decodes only the header of a message and checks it with the events() filter and message_filter
+
+        message_filter is called with the message type and the raw class, object and
+        slot names (bytes, None if the message type has no such field). For SYNC these
+        are all three, for RPC only the slot and for INIT_DATA class and object.
+        Other message types are always accepted.
+
+        If the message is accepted the stream is rewound to the start of the message,
+        otherwise it is left after the header and the caller skips the rest of the frame
+        using the frame length, as handle_data does.
+        """
+        start = stream.tell()
+        length = Quint32.decode(stream)
+        message_type = QVariant.decode(stream)
+
+        class_name = object_name = slot_name = None
+        if message_type == quassel.SYNC and length >= 4:
+            class_name = QVariant.decode(stream)
+            object_name = QVariant.decode(stream)
+            slot_name = QVariant.decode(stream)
+        elif message_type == quassel.RPC and length >= 2:
+            slot_name = QVariant.decode(stream)
+        elif message_type == quassel.INIT_DATA and length >= 3:
+            class_name = QVariant.decode(stream)
+            object_name = QVariant.decode(stream)
+        else:
+            stream.seek(start)
+            return True
+
+        accepted = not self._events_filtered or self.events_accept(message_type, class_name)
+        if accepted and self.message_filter is not None:
+            accepted = self.message_filter(message_type, class_name, object_name, slot_name)
+        if accepted:
+            stream.seek(start)
+        return accepted
+
     def handle_client_init_ack(self, data):
-        log = logging.getLogger(__name__)
         if not data['Configured']:
             log.error('Core is not configured!')
         else:
@@ -267,27 +516,78 @@ class QuasselClientProtocol(asyncio.Protocol):
             self.send_legacy_message(message)
 
     def handle_session_init(self, data):
-        log = logging.getLogger(__name__)
         self._handshake = True
+        if self.heartbeat_interval is not None:
+            self._schedule_heartbeat()
         self._identities = {}
         for identity in data['Identities']:
             self._identities[identity['identityId']] = {'nicks': identity['nicks']}
-        log.debug('Identities: {0}'.format(repr(self._identities)))
+        log.debug('Identities: %r', self._identities)
 
         self._networks = {}
         for networkid in data['NetworkIds']:
             self._networks[networkid] = None
             self.send_message([Qint16(quassel.INIT_REQUEST), 'Network'.encode('utf-8'), str(networkid).encode('utf-8')])
-        log.debug('Networks: {0}'.format(repr(self._networks)))
+        log.debug('Networks: %r', self._networks)
 
         self._buffers = {}
         for buffer in data['BufferInfos']:
             self._buffers[buffer['bufferId']] = {'name': buffer['name'], 'network': buffer['networkId'], 'type': buffer['type']}
-        log.debug('Buffers: {0}'.format(repr(self._buffers)))
+        log.debug('Buffers: %r', self._buffers)
+
+    def _schedule_heartbeat(self):
+        self._heartbeat_due = self.loop.time() + self.heartbeat_interval
+        self._heartbeat_handle = self.loop.call_at(self._heartbeat_due, self.send_heartbeat)
+
+    def send_heartbeat(self):
+        now = time.monotonic()
+        if self.metrics is not None:
+            self.metrics.loop_lag.add((self.loop.time() - self._heartbeat_due) * 1000)
+
+        if self.link_stalled(now):
+            log.warning('Link stalled, aborting connection')
+            self._heartbeat_handle = None
+            self.transport.abort()
+            return
+        if self._reading_paused:    # the reply could not be read before resuming, it would only inflate the rtt
+            self._schedule_heartbeat()
+            return
+
+        # quassel echoes the timestamp, millisecond precision so it survives the round trip
+        timestamp = int(time.time() * 1000)
+        self._heartbeats[timestamp] = now
+        self.send_message([Qint16(quassel.HEART_BEAT), QDateTime.from_epoch(timestamp)])
+        self._schedule_heartbeat()
+
+    def link_stalled(self, now):
+        # while the events() consumer holds reading paused neither data nor heartbeat
+        # replies can arrive, only the time since resuming counts
+        if self.stall_timeout is None or self._reading_paused:
+            return False
+        if now - max(self._last_received, self._reading_resumed) > self.stall_timeout:
+            return True
+        for sent in self._heartbeats.values():     # oldest unanswered heartbeat
+            return now - max(sent, self._reading_resumed) > self.stall_timeout
+        return False
+
+    def handle_heart_beat_reply(self, timestamp):
+        if self.date_mode != qtdatastream.DATE_MODE_EPOCH:
+            timestamp = QDateTime.to_epoch(timestamp)
+        sent = self._heartbeats.pop(timestamp, None)
+        if sent is None:
+            log.debug('heart beat reply for unknown heart beat %r', timestamp)
+            return
+
+        # replies come in order, anything sent earlier is lost
+        while self._heartbeats and next(iter(self._heartbeats.values())) < sent:
+            self._heartbeats.popitem(last=False)
+
+        self.latency = time.monotonic() - sent
+        if self.metrics is not None:
+            self.metrics.rtt.add(self.latency * 1000)
 
     def handle_regular_message(self, message):
-        log = logging.getLogger(__name__)
-        log.debug('message: {0}'.format(repr(message)))
+        log.debug('message: %r', message)
 
         if len(message) == 0:
             log.error('invalid message')
@@ -309,6 +609,7 @@ class QuasselClientProtocol(asyncio.Protocol):
             params = message[4:]
 
             # call object!
+            self.queue_event(message_type, class_name, object_name, function_name, params)
 
         elif message_type == quassel.RPC:
             log.debug('rpc call')
@@ -317,6 +618,7 @@ class QuasselClientProtocol(asyncio.Protocol):
                 return
 
             # handle rpc call
+            self.queue_event(message_type, None, None, message[1], message[2:])
 
         elif message_type == quassel.INIT_REQUEST:
             log.debug('init request')
@@ -333,6 +635,10 @@ class QuasselClientProtocol(asyncio.Protocol):
                 return
 
             # handle init data
+            object_name = message[2]
+            if object_name is not None:
+                object_name = object_name.decode('utf-8')
+            self.queue_event(message_type, message[1], object_name, None, message[3:])
 
         elif message_type == quassel.HEART_BEAT:
             log.debug('heart beat')
@@ -340,7 +646,10 @@ class QuasselClientProtocol(asyncio.Protocol):
             if len(message) != 2:
                 log.error('invalid heart beat')
 
-            self.send_message([Qint16(quassel.HEART_BEAT_REPLY), message[1]])
+            timestamp = message[1]
+            if self.date_mode == qtdatastream.DATE_MODE_EPOCH:
+                timestamp = QDateTime.from_epoch(timestamp)
+            self.send_message([Qint16(quassel.HEART_BEAT_REPLY), timestamp])
 
         elif message_type == quassel.HEART_BEAT_REPLY:
             log.debug('heart beat reply')
@@ -348,7 +657,7 @@ class QuasselClientProtocol(asyncio.Protocol):
             if len(message) != 2:
                 log.error('invalid heart beat reply')
 
-            # handle heart beat reply!
+            self.handle_heart_beat_reply(message[1])
 
         else:
             log.error('invalid message type {0}'.format(message_type))
@@ -0,0 +1,133 @@
+"""Checks reconnects, backoff and stats of the ConnectionManager against a local server
+
+Run directly or with pytest.
+"""
+
+import asyncio
+import random
+import socket
+
+import quassel
+
+PROBE_SIZE = 8      # requested features and protocol list sent by connection_made
+
+
+class Server:
+    """Local server that reads the probe of each connection and optionally closes it"""
+    def __init__(self, loop, close=False):
+        self.loop = loop
+        self.close = close
+        self.connections = 0
+        self.writers = []
+        self.server = loop.run_until_complete(asyncio.start_server(self.handle, '127.0.0.1', 0))
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def handle(self, reader, writer):
+        self.connections += 1
+        await reader.readexactly(PROBE_SIZE)
+        if self.close:
+            writer.close()
+        else:
+            self.writers.append(writer)
+
+    def shutdown(self):
+        for writer in self.writers:
+            writer.close()
+        self.server.close()
+        self.loop.run_until_complete(self.server.wait_closed())
+
+
+class RecordingLoop:
+    """Stands in for the event loop when only the scheduled reconnect delays matter"""
+    def __init__(self):
+        self.delays = []
+
+    def call_later(self, delay, callback, *args):
+        self.delays.append(delay)
+
+
+def unused_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def run_until(loop, condition, timeout=5.0):
+    async def wait():
+        while not condition():
+            await asyncio.sleep(0.005)
+    loop.run_until_complete(asyncio.wait_for(wait(), timeout))
+
+
+def test_backoff():
+    random.seed(1)
+    manager = quassel.ConnectionManager(RecordingLoop(), reconnect_delay=1.0, max_reconnect_delay=60.0)
+    account = manager.add_account('a', '127.0.0.1', 1, 'user', 'password')
+    for attempt in range(10):
+        manager._schedule_reconnect(account)
+    for attempt, delay in enumerate(manager.loop.delays):
+        limit = min(60.0, 2.0 ** attempt)
+        assert limit / 2 <= delay <= limit, (attempt, delay)
+    assert account.attempts == 10
+
+
+def test_reconnect_after_connection_lost():
+    loop = asyncio.new_event_loop()
+    server = Server(loop, close=True)
+    manager = quassel.ConnectionManager(loop, reconnect_delay=0.01, max_reconnect_delay=0.02)
+    account = manager.add_account('a', '127.0.0.1', server.port, 'user', 'password')
+    manager.start()
+    try:
+        run_until(loop, lambda: server.connections >= 3)
+        run_until(loop, lambda: account.bytes_sent >= 2 * PROBE_SIZE)
+    finally:
+        manager.stop()
+        server.shutdown()
+        loop.close()
+    assert account.bytes_sent % PROBE_SIZE == 0
+    assert account.attempts >= 2    # sessions never came up, the delay keeps growing
+
+
+def test_unreachable_account():
+    loop = asyncio.new_event_loop()
+    manager = quassel.ConnectionManager(loop, reconnect_delay=0.01, max_reconnect_delay=0.02)
+    account = manager.add_account('a', '127.0.0.1', unused_port(), 'user', 'password')
+    manager.start()
+    try:
+        run_until(loop, lambda: account.attempts >= 3)
+        assert account.protocol is None
+        assert manager.stats()['connected'] == 0
+    finally:
+        manager.stop()
+        loop.close()
+    assert account.reconnect_handle is None
+
+
+def test_stats():
+    loop = asyncio.new_event_loop()
+    server = Server(loop)
+    manager = quassel.ConnectionManager(loop, rate_interval=0.05)
+    for i in range(5):
+        manager.add_account('a{0}'.format(i), '127.0.0.1', server.port, 'user', 'password')
+    manager.start()
+    try:
+        run_until(loop, lambda: manager.stats()['connected'] == 5)
+        run_until(loop, lambda: manager.send_rate > 0)
+        stats = manager.stats()
+        assert stats['accounts'] == 5
+        assert stats['bytes_sent'] == 5 * PROBE_SIZE
+        assert stats['bytes_received'] == 0
+    finally:
+        manager.stop()
+        server.shutdown()
+        loop.close()
+    assert manager.receive_rate == manager.send_rate == 0
+    assert manager.stats()['bytes_sent'] == 5 * PROBE_SIZE     # totals survive the connections
+
+
+if __name__ == '__main__':
+    test_backoff()
+    test_reconnect_after_connection_lost()
+    test_unreachable_account()
+    test_stats()
+    print('ok')
@@ -0,0 +1,187 @@
+"""Checks the event stream and heartbeats of QuasselClientProtocol against a fake transport
+
+Run directly or with pytest.
+"""
+
+import asyncio
+
+import quassel
+from qtdatastream import Qint16, Quint32, QVariant, QVariantList
+
+
+class FakeTransport:
+    def __init__(self):
+        self.pauses = 0
+        self.resumes = 0
+        self.aborted = False
+        self.written = bytearray()
+
+    def write(self, data):
+        self.written.extend(data)
+
+    def get_write_buffer_size(self):
+        return 0
+
+    def is_closing(self):
+        return self.aborted
+
+    def abort(self):
+        self.aborted = True
+
+    def pause_reading(self):
+        assert self.pauses == self.resumes, 'reading paused twice'
+        self.pauses += 1
+
+    def resume_reading(self):
+        assert self.pauses == self.resumes + 1, 'reading resumed without pause'
+        self.resumes += 1
+
+
+def frame(message):
+    data = QVariantList([QVariant(x) for x in message]).encode()
+    return bytes(Quint32(len(data)).encode() + data)
+
+
+def sync(class_name, object_name):
+    return frame([Qint16(quassel.SYNC), class_name.encode('utf-8'), object_name.encode('utf-8'), b'setAway', True])
+
+
+def session_protocol(loop, **kwargs):
+    """Returns a protocol past the handshake, like after a successful login"""
+    protocol = quassel.QuasselClientProtocol(loop, 'user', 'password', on_connection_lost=lambda protocol, exc: None,
+                                             **kwargs)
+    protocol.transport = FakeTransport()
+    protocol._probing = False
+    protocol._handshake = True
+    return protocol
+
+
+def drain(loop, stream):
+    """Consumes events until the stream ends and returns their object names"""
+    async def consume():
+        return [event.object_name async for event in stream]
+    return loop.run_until_complete(consume())
+
+
+def test_backpressure():
+    loop = asyncio.new_event_loop()
+    protocol = session_protocol(loop)
+    stream = protocol.events(maxsize=4)
+    protocol.data_received(b''.join(sync('IrcUser', 'u{0}'.format(i)) for i in range(20)))
+    assert len(protocol._events) == 4
+    assert protocol.transport.pauses == 1
+
+    protocol.data_received(sync('IrcUser', 'u20'))      # already read from the socket, stays buffered
+    assert len(protocol._events) == 4
+
+    received = [loop.run_until_complete(stream.__anext__()).object_name for i in range(21)]
+    assert received == ['u{0}'.format(i) for i in range(21)]
+    assert protocol.transport.pauses == protocol.transport.resumes == 1
+    assert protocol._buffer.tell() == 0
+
+    protocol.data_received(sync('IrcUser', 'u21'))
+    protocol.connection_lost(None)
+    assert drain(loop, stream) == ['u21']
+    loop.close()
+
+
+def test_filter_skips_without_decoding():
+    loop = asyncio.new_event_loop()
+    protocol = session_protocol(loop)
+    stream = protocol.events(class_names=['IrcUser'])
+    protocol.data_received(b''.join(sync('IrcUser' if i % 3 == 0 else 'IrcChannel', 'x{0}'.format(i)) for i in range(9)))
+    assert protocol.metrics.frames_skipped == 6
+    assert protocol.metrics.frame_counts == {quassel.SYNC: 3}
+
+    protocol.connection_lost(None)
+    assert drain(loop, stream) == ['x0', 'x3', 'x6']
+    loop.close()
+
+
+def test_end_of_stream():
+    loop = asyncio.new_event_loop()
+    protocol = session_protocol(loop)
+    stream = protocol.events()
+    protocol.connection_lost(None)
+    assert drain(loop, stream) == []
+    loop.close()
+
+
+def test_handler_exception_while_resuming():
+    loop = asyncio.new_event_loop()
+    failures = ['x4']
+
+    def message_filter(message_type, class_name, object_name, slot_name):
+        if object_name.decode('utf-8') in failures:
+            failures.remove(object_name.decode('utf-8'))
+            raise ValueError('filter failed')
+        return True
+
+    protocol = session_protocol(loop, message_filter=message_filter)
+    stream = protocol.events(maxsize=4)
+    protocol.data_received(b''.join(sync('IrcUser', 'x{0}'.format(i)) for i in range(12)))
+    assert loop.run_until_complete(stream.__anext__()).object_name == 'x0'
+    try:
+        loop.run_until_complete(stream.__anext__())
+    except ValueError:
+        pass
+    else:
+        assert False, 'the filter exception should reach the consumer'
+    assert protocol.transport.resumes == 1      # reading does not stay paused
+
+    protocol.data_received(sync('IrcUser', 'x12'))
+    loop.call_soon(protocol.connection_lost, None)
+    assert drain(loop, stream) == ['x1', 'x2', 'x3'] + ['x{0}'.format(i) for i in range(5, 13)]
+    loop.close()
+
+
+def test_large_frame_not_copied():
+    loop = asyncio.new_event_loop()
+    protocol = session_protocol(loop)
+    stream = protocol.events()
+    data = frame([Qint16(quassel.INIT_DATA), b'Network', b'1', b'x' * (1 << 20)])
+    buffer = protocol._buffer
+    for i in range(0, len(data) - 1, 4096):
+        protocol.data_received(data[i:min(i + 4096, len(data) - 1)])
+    assert protocol._buffer is buffer       # partial frame is appended to, never compacted
+    protocol.data_received(data[-1:] + sync('IrcUser', 'after'))
+    protocol.connection_lost(None)
+    assert drain(loop, stream) == ['1', 'after']
+    loop.close()
+
+
+def run_for(loop, seconds):
+    loop.run_until_complete(asyncio.sleep(seconds))
+
+
+def test_backpressure_is_not_a_stall():
+    loop = asyncio.new_event_loop()
+    protocol = session_protocol(loop, heartbeat_interval=0.1)
+    stream = protocol.events(maxsize=4)
+    protocol.data_received(b''.join(sync('IrcUser', 'u{0}'.format(i)) for i in range(8)))
+    assert protocol.transport.pauses == 1
+    protocol._schedule_heartbeat()
+
+    run_for(loop, 0.8)      # several stall timeouts while the consumer is behind
+    assert not protocol.transport.aborted
+    assert not protocol._heartbeats     # no heartbeats whose replies cannot be read
+
+    received = [loop.run_until_complete(stream.__anext__()).object_name for i in range(8)]
+    assert received == ['u{0}'.format(i) for i in range(8)]
+    assert protocol.transport.resumes == 1
+    run_for(loop, 0.15)
+    assert not protocol.transport.aborted
+
+    run_for(loop, 0.6)      # resumed but nothing arrives, now it is a stall
+    assert protocol.transport.aborted
+    loop.close()
+
+
+if __name__ == '__main__':
+    test_backpressure()
+    test_filter_skips_without_decoding()
+    test_end_of_stream()
+    test_handler_exception_while_resuming()
+    test_large_frame_not_copied()
+    test_backpressure_is_not_a_stall()
+    print('ok')
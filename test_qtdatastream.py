@@ -0,0 +1,192 @@
+"""Checks that skip moves a stream exactly as far as decode does, that
+user types encode to what they decode from and that the batch date conversions
+agree with decoding, with and without numpy
+
+Run directly or with pytest.
+"""
+
+import datetime
+import io
+import struct
+
+import qtdatastream
+import quassel    # registers the quassel user types
+from quassel.calls import sync_call, rpc_call
+from quassel.protocol import BufferInfo
+from qtdatastream import (QBool, Qint8, Quint8, Qint16, Quint16, Qint32, Quint32, QByteArray, QString,
+                          QStringList, QDate, QTime, QDateTime, QVariant, QVariantMap, QVariantList, UserType,
+                          QUserType, DataStream, DATE_MODE_EPOCH, JULIAN_DAY_MAX)
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+def user_type(name, payload):
+    name = name.encode('utf-8') + b'\0'
+    return Quint32(len(name)).encode() + name + payload
+
+
+def variant(qt_type, payload):
+    return Quint32(qt_type).encode() + Qint8(0).encode() + payload
+
+
+def qstring(value):
+    return bytes(QString(value).encode())
+
+
+BUFFER_INFO = struct.pack('!iihI', 1, 2, 3, 4) + bytes(QByteArray(b'#channel').encode())
+MESSAGE = struct.pack('!iIIB', 9, 10, 11, 1) + BUFFER_INFO + bytes(QByteArray(b'nick').encode()) + bytes(QByteArray(b'hi').encode())
+
+SAMPLES = [
+    (QBool, bytes(QBool(True).encode())),
+    (Qint8, bytes(Qint8(-1).encode())),
+    (Quint8, bytes(Quint8(1).encode())),
+    (Qint16, bytes(Qint16(-2).encode())),
+    (Quint16, bytes(Quint16(2).encode())),
+    (Qint32, bytes(Qint32(-3).encode())),
+    (Quint32, bytes(Quint32(3).encode())),
+    (QByteArray, bytes(QByteArray(b'bytes').encode())),
+    (QByteArray, bytes(QByteArray(None).encode())),
+    (QString, qstring('string')),
+    (QString, qstring(None)),
+    (QStringList, Quint32(3).encode() + qstring('a') + qstring('') + qstring(None)),
+    (QDate, bytes(QDate(datetime.date(2016, 3, 4)).encode())),
+    (QDate, Quint32(0).encode()),
+    (QTime, bytes(QTime(datetime.time(5, 6, 7)).encode())),
+    (QTime, Quint32(0xFFFFFFFF).encode()),
+    (QDateTime, bytes(QDateTime(datetime.datetime(2016, 3, 4, 5, 6, 7)).encode())),
+    (UserType, user_type('BufferInfo', BUFFER_INFO)),
+    (UserType, user_type('Message', MESSAGE)),
+    (UserType, user_type('BufferId', Qint32(5).encode())),
+    (UserType, user_type('NetworkInfo', Quint32(1).encode() + qstring('key') + bytes(QVariant('value').encode()))),
+    (QVariant, bytes(QVariant(datetime.datetime(2016, 3, 4)).encode())),
+    (QVariantMap, Quint32(2).encode() + qstring('a') + bytes(QVariant(True).encode()) +
+     qstring('b') + variant(9, Quint32(1).encode() + bytes(QVariant(b'x').encode()))),
+]
+
+
+def check_skip(cls, payload, date_mode=None):
+    trailer = b'\xde\xad'
+    if date_mode is None:
+        decoded, skipped = io.BytesIO(payload + trailer), io.BytesIO(payload + trailer)
+    else:
+        decoded, skipped = DataStream(payload + trailer, date_mode), DataStream(payload + trailer, date_mode)
+    cls.decode(decoded)
+    cls.skip(skipped)
+    assert decoded.tell() == skipped.tell() == len(payload), (cls.__name__, decoded.tell(), skipped.tell(), len(payload))
+
+
+def test_skip_matches_decode():
+    for cls, payload in SAMPLES:
+        check_skip(cls, payload)
+
+
+def test_skip_matches_epoch_decode():
+    for cls, payload in SAMPLES:
+        check_skip(cls, payload, DATE_MODE_EPOCH)
+
+
+def test_skip_variant_list():
+    payload = Quint32(len(SAMPLES)).encode()
+    for cls, sample in SAMPLES:
+        if cls is UserType:
+            payload += Quint32(127).encode() + Qint8(0).encode() + sample
+        elif cls is QVariant:
+            payload += sample
+        elif hasattr(cls, 'QT_TYPE'):
+            payload += variant(cls.QT_TYPE, sample)
+    check_skip(QVariantList, payload)
+
+
+def test_user_type_encode():
+    buffer_info = {'bufferId': 1, 'networkId': 2, 'type': 3, 'groupId': 4, 'name': '#channel'}
+    assert bytes(QUserType('BufferId', Qint32(5)).encode()) == user_type('BufferId', Qint32(5).encode())
+    assert bytes(QUserType('BufferInfo', BufferInfo(buffer_info)).encode()) == user_type('BufferInfo', BUFFER_INFO)
+    assert UserType.decode(io.BytesIO(QUserType('BufferInfo', BufferInfo(buffer_info)).encode())) == buffer_info
+
+
+def test_call_template_user_types():
+    args = [QUserType('BufferId', Qint32(1)), QUserType('MsgId', Qint32(2))]
+    message = QVariantList([QVariant(x) for x in [Qint16(quassel.SYNC), b'BufferSyncer', b'', b'requestSetLastSeenMsg'] + args]).encode()
+    frame = sync_call('BufferSyncer', '', 'requestSetLastSeenMsg', ('BufferId', 'MsgId')).encode((Qint32(1), Qint32(2)))
+    assert frame == Quint32(len(message)).encode() + message
+
+    frame = rpc_call('2sendInput(BufferInfo,QString)', ('BufferInfo', None)).encode(
+        (BufferInfo({'bufferId': 1, 'networkId': 2, 'type': 3, 'groupId': 4, 'name': '#channel'}), 'hi'))
+    assert QVariantList.decode(io.BytesIO(frame[4:]))[2:] == [
+        {'bufferId': 1, 'networkId': 2, 'type': 3, 'groupId': 4, 'name': '#channel'}, 'hi']
+
+
+def batch_results(function, *args):
+    """Returns the result (or exception type) of function without numpy and, if installed, with numpy"""
+    results = []
+    for module in (None, numpy) if numpy is not None else (None,):
+        qtdatastream.numpy = module
+        try:
+            results.append(function(*args))
+        except ValueError:
+            results.append(ValueError)
+        finally:
+            qtdatastream.numpy = numpy
+    return results
+
+
+def decode_each(cls, payloads, date_mode=None):
+    return [cls.decode(DataStream(payload, date_mode) if date_mode else io.BytesIO(payload)) for payload in payloads]
+
+
+JULIAN_DAYS = [0, 1, 1721426, 2440588, 2457452, JULIAN_DAY_MAX]
+MILLISECONDS = [5, 7, 0xFFFFFFFF, 123, 18367008, 86399999]
+
+
+def test_dates_from_julian_days():
+    payloads = [Quint32(julian_day).encode() for julian_day in JULIAN_DAYS]
+    for result in batch_results(qtdatastream.dates_from_julian_days, JULIAN_DAYS):
+        assert result == decode_each(QDate, payloads)
+    for result in batch_results(qtdatastream.dates_from_julian_days, [JULIAN_DAY_MAX + 1]):
+        assert result is ValueError
+
+
+def test_datetimes_from_julian_days():
+    payloads = [struct.pack('!IIB', julian_day, msecs, 1) for julian_day, msecs in zip(JULIAN_DAYS, MILLISECONDS)]
+    for result in batch_results(qtdatastream.datetimes_from_julian_days, JULIAN_DAYS, MILLISECONDS):
+        assert result == decode_each(QDateTime, payloads)
+    for result in batch_results(qtdatastream.datetimes_from_julian_days, [JULIAN_DAY_MAX], [86400000]):
+        assert result is ValueError
+
+
+def test_epoch_from_julian_days():
+    payloads = [struct.pack('!IIB', julian_day, msecs, 1) for julian_day, msecs in zip(JULIAN_DAYS, MILLISECONDS)]
+    epoch = decode_each(QDateTime, payloads, DATE_MODE_EPOCH)
+    assert epoch[0] is None and epoch[2] is None
+    for result in batch_results(qtdatastream.epoch_from_julian_days, JULIAN_DAYS, MILLISECONDS):
+        assert result == epoch
+    for result in batch_results(qtdatastream.epoch_from_julian_days, JULIAN_DAYS):
+        assert result == [None if day is None else day * 86400000
+                          for day in decode_each(QDate, [Quint32(julian_day).encode() for julian_day in JULIAN_DAYS], DATE_MODE_EPOCH)]
+
+
+def test_datetimes_from_epoch():
+    payloads = [struct.pack('!IIB', julian_day, msecs, 1) for julian_day, msecs in zip(JULIAN_DAYS, MILLISECONDS)]
+    epoch = decode_each(QDateTime, payloads, DATE_MODE_EPOCH) + [-1, -10 ** 15]
+    expected = decode_each(QDateTime, payloads) + [datetime.datetime(1969, 12, 31, 23, 59, 59, 999000),
+                                                   datetime.datetime(1, 1, 1, 22, 13, 20)]
+    for result in batch_results(qtdatastream.datetimes_from_epoch, epoch):
+        assert result == expected == [QDateTime.from_epoch(x) if x is not None else None for x in epoch]
+    for result in batch_results(qtdatastream.datetimes_from_epoch, [QDateTime.to_epoch(datetime.datetime.max) + 1]):
+        assert result is ValueError
+
+
+if __name__ == '__main__':
+    test_skip_matches_decode()
+    test_skip_matches_epoch_decode()
+    test_skip_variant_list()
+    test_user_type_encode()
+    test_call_template_user_types()
+    test_dates_from_julian_days()
+    test_datetimes_from_julian_days()
+    test_epoch_from_julian_days()
+    test_datetimes_from_epoch()
+    print('ok')